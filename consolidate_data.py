@@ -1,19 +1,228 @@
-import pandas as pd
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 
+# Directory where get_raw_data.py stores the raw scraped data
+RAW_DATA_DIR = "data/raw"
+# Directory and file name of the consolidated data read by soil_health_analysis.py
+PROCESSED_DATA_DIR = "data/processed"
+CONSOLIDATED_FILE_NAME = "consolidated_soil_nutrient_data.parquet"
+# File reads and Arrow decoding release the GIL, so threads overlap the I/O of many small files
+MAX_WORKERS = (os.cpu_count() or 1) * 2
+# District files are only a few hundred rows each, so they are batched into row groups of about this many rows
+ROW_GROUP_SIZE = 64 * 1024
+
+class DistrictTask(NamedTuple):
+    """
+    One district found by _scan_districts. Names are read from the directory entries once, during the scan.
+    A path is None when that nutrient file is missing for the district.
+    """
+    year: str
+    state: str
+    district: str
+    macro: Optional[str]
+    micro: Optional[str]
+
+def _scan_districts(root):
+    """
+    Walks the <year>/<state>/ layout written by get_raw_data.py using os.scandir
+    and yields a DistrictTask for every district found.
+    """
+    with os.scandir(root) as years:
+        for year in years:
+            if not year.is_dir(follow_symlinks=False):
+                continue
+            year_name = year.name
+            with os.scandir(year.path) as states:
+                for state in states:
+                    if not state.is_dir(follow_symlinks=False):
+                        continue
+                    # Pair up <district>_macro.parquet / <district>_micro.parquet in the same scandir pass
+                    districts = {}
+                    with os.scandir(state.path) as files:
+                        for entry in files:
+                            name = entry.name.lower()
+                            if name.endswith("_macro.parquet"):
+                                districts.setdefault(entry.name[:-len("_macro.parquet")], [None, None])[0] = entry.path
+                            elif name.endswith("_micro.parquet"):
+                                districts.setdefault(entry.name[:-len("_micro.parquet")], [None, None])[1] = entry.path
+                    for district, (macro_path, micro_path) in districts.items():
+                        yield DistrictTask(year_name, state.name, district, macro_path, micro_path)
+
+def _read_table(path):
+    """
+    Reads a memory-mapped district Parquet file into a pyarrow.Table.
+    """
+    # Memory-map the file so it is decoded straight from the page cache without a copy
+    return pq.read_table(path, memory_map=True)
+
+def _normalize_schema(schema):
+    """
+    Widens integer columns to float64 and all-empty columns to string so that a column
+    inferred differently in another district can still be cast to the same output type.
+    Dictionary columns get int32 indices: pandas picks int8/int16 by category count, so a district
+    with more than 127 blocks would otherwise not fit the index type of a smaller one.
+    """
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        elif pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered))
+        fields.append(field)
+    return pa.schema(fields)
+
+def _normalize_types(table):
+    """
+    Casts a district table to its _normalize_schema types.
+    """
+    return table.cast(_normalize_schema(table.schema))
+
+def unify_schemas(schemas):
+    """
+    Merges district schemas into one output schema holding every column of every district.
+    Columns keep the order in which they are first seen; a column whose type differs between
+    districts (e.g. a number in one, text in another) is widened to string, so the values
+    of all districts can be represented.
+    """
+    fields = {}
+    for schema in schemas:
+        for field in _normalize_schema(schema):
+            seen = fields.get(field.name)
+            if seen is None:
+                fields[field.name] = field
+            elif seen.type != field.type:
+                fields[field.name] = seen.with_type(pa.string())
+    return pa.schema(list(fields.values()))
+
+def _conform(table, schema):
+    """
+    Lines a district table up with the output schema: columns are put in schema order, columns
+    the district lacks are filled with nulls and types are cast. Columns not in the schema are dropped.
+    Returns the table and the names of columns that could not be cast and were filled with nulls instead.
+    """
+    columns = []
+    failed_cols = []
+    for field in schema:
+        column = None
+        if field.name in table.column_names:
+            try:
+                column = table.column(field.name).cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                failed_cols.append(field.name)
+        if column is None:
+            column = pa.nulls(table.num_rows, type=field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema), failed_cols
+
+def _read_schema(task):
+    """
+    Reads the schema of a DistrictTask's macro file from its Parquet footer, without reading any data.
+    Returns None when the district has no macro file.
+    """
+    if task.macro is None:
+        return None
+    return pq.read_schema(task.macro)
+
+def _load_district(task):
+    """
+    Loads the macro data of one DistrictTask yielded by _scan_districts.
+    Its rows already carry dictionary-encoded year/state/district/block/nutrient_type columns.
+    Returns None when the district has no macro file.
+    """
+    if task.macro is None:
+        return None
+    return _read_table(task.macro)
+
+class ConsolidatedWriter:
+    """
+    Appends district tables to the consolidated Parquet file, one row group at a time, so at most
+    ROW_GROUP_SIZE rows are held in memory instead of the whole dataset plus a concatenated copy.
+    Tables are conformed to the output schema: pass one built with unify_schemas when all inputs are
+    known up front. Without one, the first table's columns define it, and tables that don't fit it
+    lose columns; mismatched is then set so the caller can rebuild the file from the raw data.
+    Used as a context manager: the file is written under a temporary name and only moved into place
+    when the block exits without an error, so a reader never sees a partial file.
+    get_raw_data.py uses it to consolidate districts while they are being scraped.
+    """
+    def __init__(self, output_file, schema=None):
+        self.output_file = Path(output_file)
+        self.tmp_file = self.output_file.with_name(self.output_file.name + ".tmp")
+        self.schema = schema
+        self.written = False # True once the file has been moved into place
+        self.mismatched = False # True once a table has lost a column to fit the schema
+        self._writer = None
+        self._pending = [] # Conformed districts waiting to be written as the next row group
+        self._pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._writer is None:
+            return
+        if exc_type is None and self._pending:
+            self._writer.write_table(pa.concat_tables(self._pending))
+        self._writer.close()
+        if exc_type is None:
+            os.replace(self.tmp_file, self.output_file)
+            self.written = True
+        else:
+            self.tmp_file.unlink(missing_ok=True)
+
+    def add(self, table, source):
+        """
+        Adds one district's table. source names where it came from in messages about its columns.
+        Dropped columns and skipped districts are reported through logging, so when called from
+        get_raw_data.py they end up in the scraping log.
+        """
+        table = _normalize_types(table)
+        if self._writer is None:
+            if self.schema is None:
+                self.schema = table.schema
+            self.output_file.parent.mkdir(parents=True, exist_ok=True)
+            # Parquet stores native binary values and dictionary-encodes repeated strings;
+            # zstd keeps the file small without slowing the write down
+            self._writer = pq.ParquetWriter(str(self.tmp_file), self.schema, compression="zstd")
+        extra_cols = set(table.column_names) - set(self.schema.names)
+        if extra_cols:
+            logging.warning(f"Dropping columns {sorted(extra_cols)} not present in the output schema: {source}")
+            self.mismatched = True
+        table, failed_cols = _conform(table, self.schema)
+        if failed_cols:
+            logging.error(f"Columns {failed_cols} of {source} could not be converted to the output schema and were left empty.")
+            self.mismatched = True
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if self._pending_rows >= ROW_GROUP_SIZE:
+            self._writer.write_table(pa.concat_tables(self._pending))
+            self._pending, self._pending_rows = [], 0
+
 def consolidate_data():
-    input_dir = Path.home() / "Desktop" / "SoilHealthData"
-    output_file = input_dir / "consolidated_data.csv"
-    
-    all_data = []
-    
-    for csv_file in input_dir.glob("**/*_MACRO.csv"):
-        df = pd.read_csv(csv_file)
-        df["Source"] = str(csv_file)
-        all_data.append(df)
-    
-    if all_data:
-        pd.concat(all_data).to_csv(output_file, index=False)
+    input_dir = Path(RAW_DATA_DIR)
+    output_file = Path(PROCESSED_DATA_DIR) / CONSOLIDATED_FILE_NAME
+
+    # Sorted so the output's row and column order don't depend on directory listing order
+    districts = sorted(_scan_districts(input_dir), key=lambda task: (task.year, task.state, task.district)) \
+        if input_dir.is_dir() else []
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Every district's columns are known from the file footers before anything is written,
+        # so no district loses a column or its rows to a schema fixed by an earlier one
+        schemas = [schema for schema in executor.map(_read_schema, districts) if schema is not None]
+        with ConsolidatedWriter(output_file, unify_schemas(schemas)) as writer:
+            # map() keeps the output in scan order regardless of which read finishes first
+            for task, table in zip(districts, executor.map(_load_district, districts)):
+                if table is not None:
+                    writer.add(table, task.macro)
+
+    if writer.written:
         print(f"Consolidated data saved to: {output_file}")
     else:
         print("No data files found")
@@ -1,4 +1,16 @@
-s pd
+import os
+import io
+import time
+import string
+import atexit
+import functools
+import logging
+import logging.handlers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
@@ -6,6 +18,7 @@ from selenium.webdriver.support.ui import Select, WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import NoSuchElementException, TimeoutException, StaleElementReferenceException
 from webdriver_manager.chrome import ChromeDriverManager
+from consolidate_data import ConsolidatedWriter, consolidate_data, PROCESSED_DATA_DIR, CONSOLIDATED_FILE_NAME
 
 # --- Configuration ---
 # Base URL of the website to scrape
@@ -14,304 +27,669 @@ BASE_URL = "https://soilhealth.dac.gov.in/piechart"
 OUTPUT_RAW_DIR = "data/raw"
 # Log file to record scraping progress and errors
 LOG_FILE = "scraping_log.log"
+# JavaScript returning [value, text] for every option of a dropdown (or null if it is not on the page),
+# so a whole option list is read in one browser round-trip instead of two per option
+OPTIONS_SCRIPT = """
+const select = document.getElementById(arguments[0]);
+return select ? Array.from(select.options).map(o => [o.value, o.text.trim()]) : null;
+"""
+# JavaScript returning the HTML of a table (or null if it is not on the page), read in one
+# browser round-trip instead of locating the element and then fetching its attribute
+TABLE_HTML_SCRIPT = """
+const table = document.getElementById(arguments[0]);
+return table ? table.outerHTML : null;
+"""
+# Columns added to every scraped table to identify where its rows came from
+ID_COLUMNS = ["year", "state", "district", "block", "nutrient_type"]
+# Tab pane ID and table ID of each nutrient type's section on the page
+NUTRIENT_SECTIONS = {
+    "macro": ("MacroNutrient", "gridMacroNutrient"),
+    "micro": ("MicroNutrient", "gridMicroNutrient"),
+}
+# Locators of each nutrient type's tab and "Table View" button, built once instead of on every block.
+# The button has no id or distinguishing class, so it is still matched by its text with XPath.
+NUTRIENT_LOCATORS = {
+    nutrient_type: {
+        "tab": (By.CSS_SELECTOR, f"a[href='#{pane_id}']"),
+        "table_view": (By.XPATH, f"//div[@id='{pane_id}']//a[contains(text(),'Table View')]"),
+    }
+    for nutrient_type, (pane_id, _) in NUTRIENT_SECTIONS.items()
+}
+# Locator matching any rendered nutrient table, used to detect when a block's tables are replaced
+NUTRIENT_TABLES_LOCATOR = (By.CSS_SELECTOR, ", ".join(f"#{table_id}" for _, table_id in NUTRIENT_SECTIONS.values()))
+# Maps every ASCII character that is not a letter or digit to "_" for str.translate, used to build safe file and directory names
+_SANITIZE_TABLE = {code: "_" for code in range(128) if chr(code) not in string.ascii_letters + string.digits}
+# Environment variable holding the installed ChromeDriver path; set by the parent and inherited by the worker processes
+CHROMEDRIVER_PATH_ENV = "CHROMEDRIVER_PATH"
+# File caching the installed ChromeDriver path between runs, so webdriver_manager is only consulted when it is missing
+CHROMEDRIVER_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "soil_scraper", "chromedriver_path")
+# Seconds a worker waits before retrying a failed browser start, e.g. while several browsers launch at once
+DRIVER_RETRY_DELAY = 2
+# How often every explicit wait re-checks its condition, in seconds
+WAIT_POLL_FREQUENCY = 0.25
+# Exceptions every explicit wait treats as "not ready yet" and keeps polling through, e.g. when the
+# page re-renders an element while a condition is being checked
+WAIT_IGNORED_EXCEPTIONS = (NoSuchElementException, StaleElementReferenceException)
+# Number of worker processes, each driving its own headless browser, scraping districts in parallel
+MAX_WORKERS = 8
 
 # --- Logging Setup ---
-# Configure logging to write messages to both a file and the console.
-# INFO level messages and above will be recorded.
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler(LOG_FILE),  # Log to file
-                        logging.StreamHandler()         # Log to console
-                    ])
+# Log calls only put the record on a queue; a background QueueListener thread in the main process
+# writes it to both a file and the console, so the scraping loop never waits on disk or terminal I/O.
+# INFO level messages and above will be recorded. Year/state progress is logged at INFO,
+# per-district and per-block progress only at DEBUG.
+LOG_FORMAT = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+def _use_log_queue(log_queue):
+    """
+    Routes this process's log records to log_queue. Also the initializer of the district worker
+    processes, so their records reach the main process's listener whether the workers are forked
+    or started fresh (spawn/forkserver), in which case they don't inherit the main process's handlers.
+    """
+    # The queue handler only merges the message arguments; timestamps are added by LOG_FORMAT
+    logging.basicConfig(level=logging.INFO,
+                        format='%(message)s',
+                        handlers=[logging.handlers.QueueHandler(log_queue)],
+                        force=True)
+
+def setup_logging():
+    """
+    Starts the listener writing queued log records to LOG_FILE and the console, and returns the
+    multiprocessing queue it reads from. Called once, by the main process.
+    """
+    file_handler = logging.FileHandler(LOG_FILE)  # Log to file
+    file_handler.setFormatter(LOG_FORMAT)
+    # Records for the log file are buffered and written in batches of up to 1000 instead of one write
+    # and flush each; an ERROR or worse is written out immediately along with everything before it
+    file_buffer = logging.handlers.MemoryHandler(capacity=1000, flushLevel=logging.ERROR, target=file_handler)
+    console_handler = logging.StreamHandler()     # Log to console
+    console_handler.setFormatter(LOG_FORMAT)
+    # A multiprocessing queue is used so records from the district worker processes reach the same listener
+    log_queue = multiprocessing.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, file_buffer, console_handler)
+    _use_log_queue(log_queue)
+    log_listener.start()
+    # atexit runs these in reverse order: stop the listener to drain the queue, then write the buffered records to the file
+    atexit.register(file_buffer.close)
+    atexit.register(log_listener.stop)
+    return log_queue
 
 # --- Helper Functions ---
-def setup_driver():
+def retry_on_stale(max_attempts=5, base_delay=0.1):
+    """
+    Decorator that calls the function again when it raises StaleElementReferenceException
+    because the page re-rendered under it. Waits base_delay * 2**attempt between attempts
+    (0.1, 0.2, 0.4, 0.8s by default) and re-raises once max_attempts is reached.
+    The decorated function must locate its elements afresh on every call.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(max_attempts):
+                try:
+                    return func(*args, **kwargs)
+                except StaleElementReferenceException:
+                    if attempt == max_attempts - 1:
+                        logging.warning(f"Element still stale in {func.__name__} after {max_attempts} attempts.")
+                        raise
+                    delay = base_delay * 2 ** attempt
+                    logging.debug("StaleElementReferenceException in %s. Retrying in %.1fs...", func.__name__, delay)
+                    time.sleep(delay)
+        return wrapper
+    return decorator
+
+def get_chromedriver_path(refresh=False):
+    """
+    Returns the path of the ChromeDriver binary, installing it with webdriver_manager only when needed.
+    The path is looked up in the CHROMEDRIVER_PATH_ENV environment variable, then in CHROMEDRIVER_CACHE_FILE.
+    Whichever is found (or newly installed) is exported to the environment so the worker processes
+    started afterwards reuse it without another version check over the network.
+    Pass refresh=True to ignore both and install again (e.g. after a Chrome update).
+    """
+    path = None
+    if not refresh:
+        path = os.environ.get(CHROMEDRIVER_PATH_ENV)
+        if not path and os.path.exists(CHROMEDRIVER_CACHE_FILE):
+            with open(CHROMEDRIVER_CACHE_FILE) as f:
+                path = f.read().strip()
+    if not path or not os.path.exists(path):
+        # Automatically downloads and installs the correct ChromeDriver version
+        path = ChromeDriverManager().install()
+        try:
+            os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE_FILE), exist_ok=True)
+            with open(CHROMEDRIVER_CACHE_FILE, "w") as f:
+                f.write(path)
+        except OSError as e:
+            logging.warning(f"Could not cache the ChromeDriver path in {CHROMEDRIVER_CACHE_FILE}: {e}")
+    os.environ[CHROMEDRIVER_PATH_ENV] = path
+    return path
+
+def get_wait(driver, timeout):
+    """
+    Returns the driver's WebDriverWait for the given timeout in seconds, creating it on first use.
+    Waits are shared per driver and timeout, so every wait polls every WAIT_POLL_FREQUENCY seconds
+    and ignores WAIT_IGNORED_EXCEPTIONS.
+    """
+    wait = driver._waits.get(timeout)
+    if wait is None:
+        wait = WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL_FREQUENCY,
+                             ignored_exceptions=WAIT_IGNORED_EXCEPTIONS)
+        driver._waits[timeout] = wait
+    return wait
+
+def setup_driver(headless=True, allow_reinstall=False):
     """
     Sets up and returns a Selenium WebDriver instance for Chrome.
-    Uses webdriver_manager to automatically download and manage the ChromeDriver.
+    Uses webdriver_manager to automatically download and manage the ChromeDriver; the installed path
+    is cached (see get_chromedriver_path) so only the first setup pays for the install.
+    If Chrome fails to start, it is retried once: with a freshly installed ChromeDriver when
+    allow_reinstall is True (only the main process, so the workers never install concurrently),
+    otherwise with the same ChromeDriver after DRIVER_RETRY_DELAY seconds.
+    The browser runs headless and skips loading images; pass headless=False to watch it while debugging.
+    Raises RuntimeError if the driver cannot be set up, so a failing worker doesn't end the whole run.
     """
     logging.info("Setting up Chrome WebDriver...")
     try:
-        # Automatically downloads and installs the correct ChromeDriver version
-        service = Service(ChromeDriverManager().install())
         options = webdriver.ChromeOptions()
-        # Uncomment the line below to run the browser in headless mode (without a visible UI)
-        # options.add_argument("--headless")
+        if headless:
+            options.add_argument("--headless=new") # Run the browser without a visible UI
+            options.add_argument("--window-size=1920,1080") # Headless ignores --start-maximized; keep elements in view
         options.add_argument("--disable-gpu") # Recommended for headless mode
         options.add_argument("--no-sandbox") # Recommended for headless mode
         options.add_argument("--start-maximized") # Maximize window to ensure elements are visible and interactable
         options.add_argument("--disable-dev-shm-usage") # Overcomes limited resource problems in some environments
-
-        driver = webdriver.Chrome(service=service, options=options)
+        options.add_argument("--disable-extensions") # No extension processes per browser
+        options.add_argument("--disable-background-networking") # No update/telemetry requests competing with the scrape
+        options.add_argument("--disable-renderer-backgrounding") # Keep hidden tabs running at full speed
+        # Images are never scraped, so don't download them. Stylesheets are still loaded: the tab
+        # and "Table View" switching and the visibility waits depend on the page's CSS.
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+        # Return from driver.get() once the DOM is ready instead of after every subresource;
+        # the explicit waits on the dropdowns cover the rest
+        options.page_load_strategy = "eager"
+
+        try:
+            driver = webdriver.Chrome(service=Service(get_chromedriver_path()), options=options)
+        except Exception as e:
+            if allow_reinstall:
+                # The cached driver may no longer match the installed Chrome; install the matching one and try once more
+                logging.warning(f"Starting Chrome with the cached ChromeDriver failed, reinstalling it: {e}")
+                driver = webdriver.Chrome(service=Service(get_chromedriver_path(refresh=True)), options=options)
+            else:
+                # Most likely a transient failure; the main process already checked this ChromeDriver works
+                logging.warning(f"Starting Chrome failed, retrying in {DRIVER_RETRY_DELAY}s: {e}")
+                time.sleep(DRIVER_RETRY_DELAY)
+                driver = webdriver.Chrome(service=Service(get_chromedriver_path()), options=options)
+        driver._waits = {} # Shared WebDriverWait instances by timeout, see get_wait
         logging.info("WebDriver setup successful.")
         return driver
     except Exception as e:
-        logging.critical(f"Failed to set up WebDriver. Please ensure Chrome is installed and check your internet connection: {e}")
-        exit(1) # Exit the script if the driver cannot be set up
+        raise RuntimeError(f"Failed to set up WebDriver. Please ensure Chrome is installed and check your internet connection: {e}") from e
 
+@retry_on_stale()
 def get_dropdown_options(driver, element_id):
     """
     Retrieves all valid options (value and text) from a dropdown HTML element.
     Filters out common placeholder values like '0' or 'select'.
-    Includes a retry mechanism for StaleElementReferenceException.
+    All options are read with a single script call rather than per-option element lookups.
+    Retried with backoff on StaleElementReferenceException.
     """
     try:
         # Wait until the dropdown element is present on the page
-        dropdown_element = WebDriverWait(driver, 10).until(
+        get_wait(driver, 10).until(
             EC.presence_of_element_located((By.ID, element_id))
         )
-        select = Select(dropdown_element)
+        option_pairs = driver.execute_script(OPTIONS_SCRIPT, element_id)
+        if option_pairs is None:
+            # The dropdown was replaced between the wait and the script while the page re-rendered
+            raise StaleElementReferenceException(f"Dropdown '{element_id}' was detached from the page")
         # Extract options, filtering out placeholder values
-        options = [(option.get_attribute("value"), option.text.strip())
-                   for option in select.options
-                   if option.get_attribute("value") not in ["0", "select"] and option.text.strip() != "Select"]
+        options = [(value, text) for value, text in option_pairs
+                   if value not in ["0", "select"] and text != "Select"]
         return options
     except (NoSuchElementException, TimeoutException) as e:
         logging.error(f"Dropdown with ID '{element_id}' not found or not interactable within timeout: {e}")
         return []
-    except StaleElementReferenceException:
-        # If the element becomes stale, wait briefly and try again recursively
-        logging.warning(f"StaleElementReferenceException when getting options for {element_id}. Retrying...")
-        time.sleep(1)
-        return get_dropdown_options(driver, element_id)
 
+@retry_on_stale()
 def select_dropdown_option(driver, element_id, value):
     """
     Selects a specific option in a dropdown HTML element by its value.
-    Includes a retry mechanism for StaleElementReferenceException.
+    Retried with backoff on StaleElementReferenceException.
     """
     try:
         # Wait until the dropdown element is present and clickable
-        select_element = WebDriverWait(driver, 10).until(
+        select_element = get_wait(driver, 10).until(
             EC.element_to_be_clickable((By.ID, element_id))
         )
         select = Select(select_element)
         select.select_by_value(value)
-        logging.info(f"Selected '{select.first_selected_option.text}' in '{element_id}' dropdown.")
+        # Reading the selected text is an extra browser round-trip, so only do it when it will be logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Selected '%s' in '%s' dropdown.", select.first_selected_option.text, element_id)
         return True
     except (NoSuchElementException, TimeoutException) as e:
         logging.error(f"Could not select value '{value}' in dropdown '{element_id}': {e}")
         return False
+
+def is_displayed(driver, element_id):
+    """
+    Returns True if the element with the given ID is on the page and visible.
+    """
+    elements = driver.find_elements(By.ID, element_id)
+    try:
+        return bool(elements) and elements[0].is_displayed()
     except StaleElementReferenceException:
-        # If the element becomes stale, wait briefly and try again recursively
-        logging.warning(f"StaleElementReferenceException when selecting {value} in {element_id}. Retrying...")
-        time.sleep(1)
-        return select_dropdown_option(driver, element_id, value)
+        return False
 
+def get_option_values(driver, element_id):
+    """
+    Returns the current option values of a dropdown, or None if it is not on the page.
+    Used to notice when a dropdown has been repopulated.
+    """
+    option_pairs = driver.execute_script(OPTIONS_SCRIPT, element_id)
+    if option_pairs is None:
+        return None
+    return [value for value, _ in option_pairs]
+
+def wait_for_options_change(driver, element_id, previous_values, timeout=15):
+    """
+    Waits until a dropdown holds real (non-placeholder) options that differ from previous_values,
+    a snapshot taken before its parent dropdown was changed. Polls every 250ms, so it returns as
+    soon as the options arrive instead of sleeping for a fixed worst-case delay.
+    Returns False if the options did not change within the timeout.
+    """
+    def repopulated(d):
+        values = get_option_values(d, element_id)
+        return (values is not None and values != previous_values
+                and any(value not in ["0", "select"] for value in values))
+
+    try:
+        get_wait(driver, timeout).until(repopulated)
+        return True
+    except TimeoutException:
+        logging.debug("Options of '%s' did not change within %ss.", element_id, timeout)
+        return False
+
+def select_and_wait_for_child(driver, element_id, value, child_id):
+    """
+    Selects a value in a dropdown and waits for the dependent child dropdown to be repopulated.
+    Returns False if the selection failed.
+    """
+    previous_values = get_option_values(driver, child_id)
+    if not select_dropdown_option(driver, element_id, value):
+        return False
+    # A timeout is not fatal: the child may legitimately keep the same options, and an empty
+    # child dropdown is reported by the caller when it reads the options
+    wait_for_options_change(driver, child_id, previous_values)
+    return True
+
+@retry_on_stale()
 def get_table_data(driver, table_id):
     """
     Extracts data from a specified HTML table identified by its ID.
-    Waits for the table to be visible and present before attempting to read its content.
+    Waits for the table to show at least one row before attempting to read its content.
+    Retried with backoff on StaleElementReferenceException.
     """
     try:
-        # Wait until the table element is visible and present on the page
-        table_element = WebDriverWait(driver, 20).until(
-            EC.visibility_of_element_located((By.ID, table_id))
+        # Wait until the table has a visible row, i.e. it has rendered with content
+        get_wait(driver, 20).until(
+            EC.visibility_of_element_located((By.CSS_SELECTOR, f"#{table_id} tr"))
         )
         # Get the full HTML content of the table
-        table_html = table_element.get_attribute('outerHTML')
-        # Use pandas to read the HTML table. pd.read_html returns a list of DataFrames.
+        table_html = driver.execute_script(TABLE_HTML_SCRIPT, table_id)
+        if table_html is None:
+            # The table was replaced between the wait and the script while the page re-rendered
+            raise StaleElementReferenceException(f"Table '{table_id}' was detached from the page")
+        # Use pandas to read the HTML table with the lxml parser. pd.read_html returns a list of DataFrames.
         # We assume the first DataFrame in the list is the one we want.
-        df = pd.read_html(table_html)[0]
+        df = pd.read_html(io.StringIO(table_html), flavor='lxml')[0]
         return df
     except (NoSuchElementException, TimeoutException) as e:
         logging.error(f"Table with ID '{table_id}' not found or not loaded within timeout: {e}")
         return None
+    except StaleElementReferenceException:
+        raise # Let retry_on_stale locate the re-rendered table again
     except Exception as e:
         logging.error(f"An unexpected error occurred while extracting table '{table_id}': {e}")
         return None
 
-def save_data(df, year, state, district, block, nutrient_type):
+def _sanitize_name(name):
     """
-    Saves the DataFrame to a CSV file within the specified hierarchical directory structure.
-    Sanitizes state, district, and block names to be valid for file paths.
+    Replaces non-alphanumeric characters with underscores for safe file and directory names.
+    ASCII names go through str.translate, which runs in C; names with other characters keep the
+    per-character isalnum() check so Unicode letters and digits are preserved as before.
     """
-    # Replace non-alphanumeric characters with underscores for safe file and directory names
-    state_safe = "".join([c if c.isalnum() else "_" for c in state])
-    district_safe = "".join([c if c.isalnum() else "_" for c in district])
-    block_safe = "".join([c if c.isalnum() else "_" for c in block])
+    if name.isascii():
+        return name.translate(_SANITIZE_TABLE)
+    return "".join([c if c.isalnum() else "_" for c in name])
 
-    # Construct the full directory path: data/raw/<year>/<state>/<district>/
-    dir_path = os.path.join(OUTPUT_RAW_DIR, str(year), state_safe, district_safe)
+def _district_prefix(year, state, district):
+    """
+    Returns the path prefix data/raw/<year>/<state>/<district> of a district's output files.
+    Sanitizes state and district names to be valid for file paths.
+    """
+    # Construct the full directory path: data/raw/<year>/<state>/
+    dir_path = os.path.join(OUTPUT_RAW_DIR, str(year), _sanitize_name(state))
+    return os.path.join(dir_path, _sanitize_name(district))
+
+def _expected_paths(year, state, district):
+    """
+    Returns the output file path of each nutrient type for a district as a dict keyed by nutrient type,
+    following the data/raw/<year>/<state>/<district>_<nutrient_type>.parquet layout.
+    """
+    prefix = _district_prefix(year, state, district)
+    return {nutrient_type: f"{prefix}_{nutrient_type}.parquet" for nutrient_type in NUTRIENT_SECTIONS}
+
+def _done_marker_path(year, state, district):
+    """
+    Returns the path of the empty data/raw/<year>/<state>/<district>.done file marking a completed district.
+    """
+    return f"{_district_prefix(year, state, district)}.done"
+
+def mark_scraped(year, state, district):
+    """
+    Records that every nutrient file of the district has been saved, by creating its done marker.
+    """
+    with open(_done_marker_path(year, state, district), "w"):
+        pass
+
+def is_scraped(year, state, district):
+    """
+    Returns True if a previous run completed the district.
+    The nutrient files are written one after the other, so their presence alone can't tell a finished
+    district from one interrupted between the two saves (or a district without micro data from a failed
+    micro save). Only the done marker, written after all of them were saved, counts.
+    """
+    return os.path.exists(_done_marker_path(year, state, district))
+
+def save_data(frames, year, state, district, nutrient_type):
+    """
+    Saves the tables of one nutrient type for all blocks of a district to a single Parquet file
+    within the specified hierarchical directory structure. Rows are identified by their
+    year/state/district/block/nutrient_type columns instead of by one small file per block.
+    Returns the saved DataFrame, or None if it could not be saved.
+    """
+    file_path = _expected_paths(year, state, district)[nutrient_type]
     # Create the directory if it does not exist
-    os.makedirs(dir_path, exist_ok=True)
-    # Construct the file name: <block>_<nutrient_type>.csv
-    file_name = f"{block_safe}_{nutrient_type}.csv"
-    file_path = os.path.join(dir_path, file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
     try:
-        # Save the DataFrame to CSV without the index
-        df.to_csv(file_path, index=False)
-        logging.info(f"Saved {nutrient_type} data for Block: '{block}' in '{district}', '{state}', Year: '{year}' to {file_path}")
+        df = pd.concat(frames, ignore_index=True)
+        # Blocks can disagree on a column's type (e.g. a number in one, text in another);
+        # store such mixed object columns as strings so Parquet can write them
+        object_cols = df.select_dtypes(include="object").columns
+        df[object_cols] = df[object_cols].astype("string")
+        # The identifiers repeat one value per block, so store them as categoricals (dictionary-encoded)
+        df[ID_COLUMNS] = df[ID_COLUMNS].astype("category")
+
+        # Write to a temporary file first and move it into place, so a reader never sees a
+        # partially written file
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp_path, engine="pyarrow", compression="snappy", index=False)
+        os.replace(tmp_path, file_path)
+        logging.debug("Saved %s data for %d blocks of '%s', '%s', Year: '%s' to %s",
+                      nutrient_type, len(frames), district, state, year, file_path)
+        return df
     except Exception as e:
-        logging.error(f"Failed to save {nutrient_type} data for Block '{block}' to {file_path}: {e}")
+        logging.error(f"Failed to save {nutrient_type} data for District '{district}' to {file_path}: {e}")
+        return None
 
 # --- Main Scraping Logic ---
-def scrape_soil_data():
+def enumerate_jobs(driver):
     """
-    Main function to orchestrate the web scraping process.
-    Navigates through years, states, districts, and blocks,
-    extracting and saving soil nutrient data.
+    Walks the year, state and district dropdowns once and returns one job per district as a
+    (year_value, year_text, state_value, state_text, district_value, district_text) tuple.
+    Blocks are not enumerated here; each worker lists the blocks of its own district.
+    """
+    jobs = []
+    driver.get(BASE_URL) # Open the target URL
+    logging.info(f"Successfully navigated to {BASE_URL}")
+
+    # Wait for the year dropdown to be present on the page and filled in by JavaScript
+    wait_for_options_change(driver, "ddlYear", None, timeout=30)
+
+    # Get all available years from the 'ddlYear' dropdown
+    year_options = get_dropdown_options(driver, "ddlYear")
+    if not year_options:
+        logging.error("No years found in the dropdown. Scraping cannot proceed. Exiting.")
+        return jobs # Nothing to scrape if no years are found
+
+    # Loop through each year option
+    for year_value, year_text in year_options:
+        logging.info(f"\n--- Processing Year: {year_text} ---")
+        # Select the current year in the dropdown and wait for the state dropdown to populate
+        if not select_and_wait_for_child(driver, "ddlYear", year_value, "ddlState"):
+            continue # Skip to next year if selection fails
+
+        # Get all available states from the 'ddlState' dropdown
+        state_options = get_dropdown_options(driver, "ddlState")
+        if not state_options:
+            logging.warning(f"No states found for year {year_text}. Skipping this year.")
+            continue # Skip to next year if no states are found
+
+        # Loop through each state option
+        for state_value, state_text in state_options:
+            logging.info(f"  Processing State: {state_text}")
+            # Select the current state in the dropdown and wait for the district dropdown to populate
+            if not select_and_wait_for_child(driver, "ddlState", state_value, "ddlDistrict"):
+                continue # Skip to next state if selection fails
+
+            # Get all available districts from the 'ddlDistrict' dropdown
+            district_options = get_dropdown_options(driver, "ddlDistrict")
+            if not district_options:
+                logging.warning(f"    No districts found for State: {state_text} in Year: {year_text}. Skipping this state.")
+                continue # Skip to next state if no districts are found
+
+            for district_value, district_text in district_options:
+                jobs.append((year_value, year_text, state_value, state_text, district_value, district_text))
+
+    return jobs
+
+def scrape_nutrient(driver, nutrient_type, year_text, state_text, district_text, block_text):
+    """
+    Extracts one nutrient table ('macro' or 'micro') for the selected block and returns it with
+    the ID_COLUMNS added, or None if no data was found.
+    The nutrient's tab and its "Table View" are only clicked when they are not already showing,
+    so nothing is clicked when the page kept them from the previous block.
     """
-    driver = setup_driver() # Initialize the WebDriver
+    pane_id, table_id = NUTRIENT_SECTIONS[nutrient_type]
+    locators = NUTRIENT_LOCATORS[nutrient_type]
     try:
-        driver.get(BASE_URL) # Open the target URL
-        logging.info(f"Successfully navigated to {BASE_URL}")
+        # Click on the nutrient's tab to make its content visible and interactable
+        if not is_displayed(driver, pane_id):
+            tab = get_wait(driver, 5).until(EC.element_to_be_clickable(locators["tab"]))
+            tab.click()
+
+        # Click the "Table View" button within the nutrient's section unless the table is already shown
+        if not is_displayed(driver, table_id):
+            table_view_button = get_wait(driver, 10).until(EC.element_to_be_clickable(locators["table_view"]))
+            table_view_button.click()
+
+        # Extract data from the nutrient's table once it has rendered
+        df = get_table_data(driver, table_id)
+        if df is not None and not df.empty:
+            return df.assign(year=year_text, state=state_text, district=district_text,
+                             block=block_text, nutrient_type=nutrient_type)
+        logging.warning(f"        No {pane_id} data found or table is empty for Block: {block_text}.")
 
-        # Wait for the main elements, specifically the year dropdown, to be present on the page
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.ID, "ddlYear"))
-        )
-        time.sleep(1) # Small pause to allow JavaScript to fully load dropdown contents
-
-        # Get all available years from the 'ddlYear' dropdown
-        year_options = get_dropdown_options(driver, "ddlYear")
-        if not year_options:
-            logging.error("No years found in the dropdown. Scraping cannot proceed. Exiting.")
-            return # Exit if no years are found
-
-        # Loop through each year option
-        for year_value, year_text in year_options:
-            logging.info(f"\n--- Processing Year: {year_text} ---")
-            # Select the current year in the dropdown
-            if not select_dropdown_option(driver, "ddlYear", year_value):
-                continue # Skip to next year if selection fails
-
-            time.sleep(2) # Give time for the page to update and state dropdown to populate
-
-            # Get all available states from the 'ddlState' dropdown
-            state_options = get_dropdown_options(driver, "ddlState")
-            if not state_options:
-                logging.warning(f"No states found for year {year_text}. Skipping this year.")
-                continue # Skip to next year if no states are found
-
-            # Loop through each state option
-            for state_value, state_text in state_options:
-                logging.info(f"  Processing State: {state_text}")
-                # Select the current state in the dropdown
-                if not select_dropdown_option(driver, "ddlState", state_value):
-                    continue # Skip to next state if selection fails
-
-                # Wait for the district dropdown to become clickable after state selection
-                WebDriverWait(driver, 20).until(
-                    EC.element_to_be_clickable((By.ID, "ddlDistrict"))
-                )
-                time.sleep(1.5) # Additional pause for district options to load
-
-                # Get all available districts from the 'ddlDistrict' dropdown
-                district_options = get_dropdown_options(driver, "ddlDistrict")
-                if not district_options:
-                    logging.warning(f"    No districts found for State: {state_text} in Year: {year_text}. Skipping this state.")
-                    continue # Skip to next state if no districts are found
-
-                # Loop through each district option
-                for district_value, district_text in district_options:
-                    logging.info(f"    Processing District: {district_text}")
-                    # Select the current district in the dropdown
-                    if not select_dropdown_option(driver, "ddlDistrict", district_value):
-                        continue # Skip to next district if selection fails
-
-                    # Wait for the block dropdown to become clickable after district selection
-                    WebDriverWait(driver, 20).until(
-                        EC.element_to_be_clickable((By.ID, "ddlBlock"))
-                    )
-                    time.sleep(1.5) # Additional pause for block options to load
-
-                    # Get all available blocks from the 'ddlBlock' dropdown
-                    block_options = get_dropdown_options(driver, "ddlBlock")
-                    if not block_options:
-                        logging.warning(f"      No blocks found for District: {district_text} in State: {state_text}, Year: {year_text}. Skipping this district.")
-                        continue # Skip to next district if no blocks are found
-
-                    # Loop through each block option
-                    for block_value, block_text in block_options:
-                        logging.info(f"      Processing Block: {block_text}")
-                        try:
-                            # Re-select the block to ensure the correct content loads, especially if the page reloads dynamically
-                            if not select_dropdown_option(driver, "ddlBlock", block_value):
-                                continue # Skip to next block if selection fails
-
-                            time.sleep(1.5) # Wait for the nutrient tabs/tables to load after block selection
-
-                            # --- Process MacroNutrient Data ---
-                            try:
-                                # Define XPath for the "Table View" button within the MacroNutrient section
-                                macro_table_view_xpath = "//div[@id='MacroNutrient']//a[contains(text(),'Table View')]"
-                                # Wait for the button to be clickable and then click it
-                                macro_table_view_button = WebDriverWait(driver, 10).until(
-                                    EC.element_to_be_clickable((By.XPATH, macro_table_view_xpath))
-                                )
-                                macro_table_view_button.click()
-                                time.sleep(1) # Allow time for the table to render after clicking "Table View"
-
-                                # Extract data from the 'gridMacroNutrient' table
-                                macro_df = get_table_data(driver, "gridMacroNutrient")
-                                if macro_df is not None and not macro_df.empty:
-                                    save_data(macro_df, year_text, state_text, district_text, block_text, "macro")
-                                else:
-                                    logging.warning(f"        No MacroNutrient data found or table is empty for Block: {block_text}.")
-
-                            except (NoSuchElementException, TimeoutException) as e:
-                                logging.warning(f"        MacroNutrient 'Table View' button or table not found for Block: {block_text}: {e}")
-                            except Exception as e:
-                                logging.error(f"        Error processing MacroNutrient for Block: {block_text}: {e}")
-
-                            # --- Process MicroNutrient Data ---
-                            # First, click on the MicroNutrient tab to make its content visible and interactable
-                            try:
-                                micro_tab_xpath = "//a[@href='#MicroNutrient']"
-                                micro_tab = WebDriverWait(driver, 5).until(
-                                    EC.element_to_be_clickable((By.XPATH, micro_tab_xpath))
-                                )
-                                micro_tab.click()
-                                time.sleep(1) # Allow time for the tab content to switch
-
-                                # Define XPath for the "Table View" button within the MicroNutrient section
-                                micro_table_view_xpath = "//div[@id='MicroNutrient']//a[contains(text(),'Table View')]"
-                                # Wait for the button to be clickable and then click it
-                                micro_table_view_button = WebDriverWait(driver, 10).until(
-                                    EC.element_to_be_clickable((By.XPATH, micro_table_view_xpath))
-                                )
-                                micro_table_view_button.click()
-                                time.sleep(1) # Allow time for the table to render after clicking "Table View"
-
-                                # Extract data from the 'gridMicroNutrient' table
-                                micro_df = get_table_data(driver, "gridMicroNutrient")
-                                if micro_df is not None and not micro_df.empty:
-                                    save_data(micro_df, year_text, state_text, district_text, block_text, "micro")
-                                else:
-                                    logging.warning(f"        No MicroNutrient data found or table is empty for Block: {block_text}.")
-
-                            except (NoSuchElementException, TimeoutException) as e:
-                                logging.warning(f"        MicroNutrient 'Table View' button or table not found for Block: {block_text}: {e}")
-                            except Exception as e:
-                                logging.error(f"        Error processing MicroNutrient for Block: {block_text}: {e}")
-
-                            # After processing both, it's good practice to switch back to MacroNutrient tab
-                            # This ensures the page is in a consistent state for the next block selection
-                            try:
-                                macro_tab_xpath = "//a[@href='#MacroNutrient']"
-                                macro_tab = WebDriverWait(driver, 5).until(
-                                    EC.element_to_be_clickable((By.XPATH, macro_tab_xpath))
-                                )
-                                macro_tab.click()
-                                time.sleep(0.5)
-                            except Exception as e:
-                                logging.debug(f"Could not switch back to MacroNutrient tab after processing block {block_text}: {e}")
-
-                        except Exception as e:
-                            logging.error(f"        An unhandled error occurred while processing Block: {block_text} in {district_text}, {state_text}, {year_text}. Skipping to next block. Error: {e}")
-                            # Continue to the next block even if there's a problem with the current one
+    except (NoSuchElementException, TimeoutException) as e:
+        logging.warning(f"        {pane_id} 'Table View' button or table not found for Block: {block_text}: {e}")
+    except Exception as e:
+        logging.error(f"        Error processing {pane_id} for Block: {block_text}: {e}")
+    return None
+
+def process_block(driver, year_text, state_text, district_text, block_value, block_text):
+    """
+    Selects one block in the already selected district and returns its MacroNutrient and
+    MicroNutrient tables as a dict keyed by nutrient type. Types without data are left out.
+    """
+    block_frames = {}
+    # Remember the table rendered for the previous block, if any, to tell when it has been replaced
+    previous_tables = driver.find_elements(*NUTRIENT_TABLES_LOCATOR)
+
+    # Re-select the block to ensure the correct content loads, especially if the page reloads dynamically
+    if not select_dropdown_option(driver, "ddlBlock", block_value):
+        return block_frames # Skip this block if selection fails
+
+    # The page re-renders for the new block, which detaches the previous block's table.
+    # Waiting for that, rather than a fixed sleep, makes sure old data is never read: if the
+    # table is not replaced in time, the block is skipped rather than saving the previous block's data.
+    if previous_tables:
+        try:
+            get_wait(driver, 5).until(EC.staleness_of(previous_tables[0]))
+        except TimeoutException:
+            logging.warning(f"        Previous table was not replaced after selecting Block: {block_text}. Skipping this block.")
+            return block_frames
+
+    # Start with whichever nutrient tab is already showing, so no click is spent switching to it.
+    # The other tab is left showing for the next block instead of switching back.
+    if is_displayed(driver, NUTRIENT_SECTIONS["micro"][0]):
+        nutrient_order = ["micro", "macro"]
+    else:
+        nutrient_order = ["macro", "micro"]
+    for nutrient_type in nutrient_order:
+        df = scrape_nutrient(driver, nutrient_type, year_text, state_text, district_text, block_text)
+        if df is not None:
+            block_frames[nutrient_type] = df
+    return block_frames
+
+def process_district(job):
+    """
+    Worker entry point. Starts its own headless browser, selects the job's year, state and
+    district, then scrapes every block in that district and saves one file per nutrient type.
+    Returns the saved DataFrames keyed by nutrient type, so the parent can consolidate them.
+    """
+    year_value, year_text, state_value, state_text, district_value, district_text = job
+    saved = {}
+    logging.debug("    Processing District: %s", district_text)
+    driver = None
+    try:
+        driver = setup_driver() # Each worker process owns its browser
+        driver.get(BASE_URL)
+        wait_for_options_change(driver, "ddlYear", None, timeout=30)
+
+        # Select the job's year, state and district, waiting each time for the next dropdown to populate
+        if not select_and_wait_for_child(driver, "ddlYear", year_value, "ddlState"):
+            return saved
+        if not select_and_wait_for_child(driver, "ddlState", state_value, "ddlDistrict"):
+            return saved
+        if not select_and_wait_for_child(driver, "ddlDistrict", district_value, "ddlBlock"):
+            return saved
+
+        # Get all available blocks from the 'ddlBlock' dropdown
+        block_options = get_dropdown_options(driver, "ddlBlock")
+        if not block_options:
+            logging.warning(f"      No blocks found for District: {district_text} in State: {state_text}, Year: {year_text}. Skipping this district.")
+            return saved
+
+        # Loop through each block option, collecting its tables per nutrient type
+        district_frames = {nutrient_type: [] for nutrient_type in NUTRIENT_SECTIONS}
+        incomplete_blocks = [] # Blocks that failed or are missing a nutrient table
+        for block_value, block_text in block_options:
+            logging.debug("      Processing Block: %s", block_text)
+            try:
+                block_frames = process_block(driver, year_text, state_text, district_text, block_value, block_text)
+                for nutrient_type, df in block_frames.items():
+                    district_frames[nutrient_type].append(df)
+                if len(block_frames) < len(NUTRIENT_SECTIONS):
+                    incomplete_blocks.append(block_text)
+            except Exception as e:
+                logging.error(f"        An unhandled error occurred while processing Block: {block_text} in {district_text}, {state_text}, {year_text}. Skipping to next block. Error: {e}")
+                incomplete_blocks.append(block_text)
+                # Continue to the next block even if there's a problem with the current one
+
+        # Save each nutrient type's blocks for the district in one file
+        all_saved = True
+        for nutrient_type, frames in district_frames.items():
+            if frames:
+                df = save_data(frames, year_text, state_text, district_text, nutrient_type)
+                if df is not None:
+                    saved[nutrient_type] = df
+                else:
+                    all_saved = False
+        # Only a district whose blocks all returned their tables and whose files were all saved is
+        # skipped by the next run; otherwise the next run scrapes it again
+        if incomplete_blocks:
+            logging.warning(f"      {len(incomplete_blocks)} of {len(block_options)} blocks of District: {district_text} in {state_text}, {year_text} "
+                            f"are incomplete and will be scraped again on the next run: {incomplete_blocks}")
+        elif saved and all_saved:
+            mark_scraped(year_text, state_text, district_text)
 
     except Exception as e:
-        logging.critical(f"A critical, unrecoverable error occurred during the overall scraping process: {e}")
+        logging.error(f"    An error occurred while processing District: {district_text} in {state_text}, {year_text}. Skipping this district. Error: {e}")
     finally:
-        logging.info("Scraping finished. Closing browser.")
-        if driver: # Ensure driver exists before quitting
+        if driver is not None:
             driver.quit()
+    return saved
+
+def scrape_soil_data(log_queue):
+    """
+    Main function to orchestrate the web scraping process.
+    Enumerates every (year, state, district) once with a single browser, then scrapes the
+    districts in parallel across MAX_WORKERS processes, each with its own headless browser.
+    The workers send their log records to log_queue, as returned by setup_logging().
+    The consolidated file read by soil_health_analysis.py is written as districts finish, so
+    running consolidate_data.py afterwards is no longer needed.
+    """
+    # Initialize the WebDriver used for enumeration. This also installs ChromeDriver if needed and
+    # exports its path, so the worker processes started below don't each check for it again.
+    # Only this process may reinstall it.
+    try:
+        driver = setup_driver(allow_reinstall=True)
+    except RuntimeError as e:
+        logging.critical(f"Cannot start scraping: {e}")
+        return
+    try:
+        jobs = enumerate_jobs(driver)
+    except Exception as e:
+        logging.critical(f"A critical, unrecoverable error occurred while listing districts to scrape: {e}")
+        return
+    finally:
+        driver.quit() # The workers start their own browsers
+
+    # Resume an interrupted run: districts saved by a previous run are not scraped again,
+    # so their browsers and block selections are skipped entirely
+    saved_jobs, pending_jobs = [], []
+    for job in jobs:
+        (saved_jobs if is_scraped(job[1], job[3], job[5]) else pending_jobs).append(job)
+    jobs = pending_jobs
+    if saved_jobs:
+        logging.info(f"Skipping {len(saved_jobs)} districts already saved in {OUTPUT_RAW_DIR}.")
+
+    consolidated_file = os.path.join(PROCESSED_DATA_DIR, CONSOLIDATED_FILE_NAME)
+    logging.info(f"Found {len(jobs)} districts to scrape. Starting {MAX_WORKERS} worker processes.")
+    try:
+        # Like consolidate_data.py, the consolidated file holds the macro-nutrient data. Each district is
+        # appended as its worker returns it, instead of reading every raw file back after the scrape.
+        with ConsolidatedWriter(consolidated_file) as writer:
+            # Districts saved by a previous run are read back from their raw files
+            for job in saved_jobs:
+                macro_path = _expected_paths(job[1], job[3], job[5])["macro"]
+                if os.path.exists(macro_path):
+                    writer.add(pq.read_table(macro_path), macro_path)
+
+            with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_use_log_queue,
+                                     initargs=(log_queue,)) as executor:
+                # process_district handles its own errors; consuming the results waits for every job
+                for job, saved in zip(jobs, executor.map(process_district, jobs)):
+                    if "macro" in saved:
+                        writer.add(pa.Table.from_pandas(saved["macro"], preserve_index=False),
+                                   f"{job[5]}, {job[3]}, {job[1]}")
+        if writer.mismatched:
+            # The schema was fixed by the first district, so columns were lost on the way. Rebuild the
+            # file from the raw files, which consolidate_data() reads with a schema covering all districts.
+            logging.warning("Some districts did not fit the consolidated schema. Rebuilding it from the raw files.")
+            consolidate_data()
+        elif writer.written:
+            logging.info(f"Consolidated data saved to: {consolidated_file}")
+    except Exception as e:
+        logging.critical(f"A critical, unrecoverable error occurred during the overall scraping process: {e}")
+    finally:
+        logging.info("Scraping finished.")
 
 if __name__ == "__main__":
+    log_queue = setup_logging()
     # Ensure the base output directory for raw data exists before starting the scrape
     os.makedirs(OUTPUT_RAW_DIR, exist_ok=True)
-    scrape_soil_data()
+    scrape_soil_data(log_queue)
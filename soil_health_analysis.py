@@ -1,28 +1,137 @@
 import pandas as pd
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 import seaborn as sns
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Configuration ---
 # Directory where processed (consolidated) data is stored
 PROCESSED_DATA_DIR = "data/processed"
-# Name of the consolidated CSV file to be analyzed
-CONSOLIDATED_FILE_NAME = "consolidated_soil_nutrient_data.csv"
+# Name of the consolidated Parquet file to be analyzed
+CONSOLIDATED_FILE_NAME = "consolidated_soil_nutrient_data.parquet"
 # Directory where analysis results (plots) will be saved
 ANALYSIS_OUTPUT_DIR = "analysis_results"
 # Log file to record analysis progress and findings
 LOG_FILE = "analysis_log.log"
+# Identifier columns used for grouping
+ID_COLS = ['year', 'state', 'district', 'block']
+# Key nutrient columns. These columns are assumed to be numerical and represent nutrient values.
+# Adjust this list based on the actual standardized column names from consolidate_data.py
+# Common macro-nutrients: Nitrogen, Phosphorus, Potassium, Organic Carbon (pH is a property)
+# Common micro-nutrients: Zinc, Iron, Manganese, Copper, Boron
+# This list is based on common soil health parameters; verify against your actual data.
+POTENTIAL_NUTRIENT_COLS = [
+    'ph', 'ec', 'oc_percent', 'nitrogen', 'phosphorus', 'potassium',
+    'sulphur', 'zinc', 'iron', 'manganese', 'copper', 'boron'
+]
+
+# Number of processes rendering plots in parallel; each figure is drawn and saved by one process
+PLOT_WORKERS = os.cpu_count() or 1
 
 # --- Logging Setup ---
-# Configure logging to write messages to both a file and the console.
-# INFO level messages and above will be recorded.
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    handlers=[
-                        logging.FileHandler(LOG_FILE),  # Log to file
-                        logging.StreamHandler()         # Log to console
-                    ])
+def setup_logging():
+    """
+    Configures logging to write messages to both a file and the console.
+    INFO level messages and above will be recorded. Called only by the main process, so the
+    plot worker processes, which re-import this module under spawn/forkserver, don't open the log file.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s',
+                        handlers=[
+                            logging.FileHandler(LOG_FILE),  # Log to file
+                            logging.StreamHandler()         # Log to console
+                        ])
+
+# --- Plotting Functions ---
+# Each function draws and saves one figure from the data it is given and returns the file name.
+# They run in PLOT_WORKERS worker processes, so they only receive the columns or aggregates they plot.
+def _init_plot_worker():
+    """
+    Sets the plotting backend and a consistent style in a plot worker process.
+    """
+    plt.switch_backend('Agg') # Workers only save files, no display is needed
+    sns.set_style("whitegrid")
+    plt.rcParams['figure.dpi'] = 100 # Set higher DPI for better quality images
+    plt.rcParams['figure.figsize'] = (10, 6) # Default figure size
+
+def _plot_trend(year_avg, nutrient):
+    """
+    Line plot of a nutrient's yearly average. year_avg has 'year' and nutrient columns.
+    """
+    file_name = f'{nutrient}_trend_over_years.png'
+    plt.figure() # Create a new figure for each plot
+    sns.lineplot(data=year_avg, x='year', y=nutrient, marker='o')
+    plt.title(f'Average {nutrient.replace("_", " ").title()} Over Years')
+    plt.xlabel('Year')
+    plt.ylabel(f'Average {nutrient.replace("_", " ").title()} Value')
+    plt.grid(True, linestyle='--', alpha=0.7)
+    plt.tight_layout()
+    plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, file_name))
+    plt.close() # Close the plot to free memory
+    return file_name
+
+def _plot_distributions(nutrient_values):
+    """
+    Histograms of all nutrient columns as panels of one grid figure, so the figure setup
+    and savefig are paid once instead of once per nutrient.
+    """
+    file_name = 'all_distributions.png'
+    melted = nutrient_values.melt(var_name='nutrient', value_name='value')
+    g = sns.FacetGrid(melted, col='nutrient', col_wrap=4, sharex=False, sharey=False, height=3, aspect=1.3)
+    g.map(sns.histplot, 'value', kde=True, bins=30)
+    g.set_titles('Distribution of {col_name}')
+    g.set_axis_labels('Value', 'Frequency')
+    g.tight_layout()
+    g.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, file_name))
+    plt.close(g.figure)
+    return file_name
+
+def _plot_ph_boxplot(ph_by_state):
+    """
+    Box plot of pH per state. ph_by_state has 'state' and 'ph' columns.
+    """
+    file_name = 'ph_by_state_boxplot.png'
+    plt.figure(figsize=(14, 8)) # Wider plot for many states
+    sns.boxplot(data=ph_by_state, x='state', y='ph', palette='viridis')
+    plt.title('pH Distribution Across States')
+    plt.xlabel('State')
+    plt.ylabel('pH Value')
+    plt.xticks(rotation=60, ha='right') # Rotate labels for readability
+    plt.tight_layout()
+    plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, file_name))
+    plt.close()
+    return file_name
+
+def _plot_state_bars(state_avg):
+    """
+    Bar plots of state averages, one panel per nutrient. state_avg is in long form with
+    'state', 'nutrient' and 'value' columns.
+    """
+    file_name = 'nutrients_by_state_barplot.png'
+    g = sns.catplot(data=state_avg, kind='bar', col='nutrient', col_wrap=3, x='state', y='value',
+                    palette='coolwarm', sharey=False, height=5, aspect=1.6)
+    g.set_titles('Average {col_name} Across States')
+    g.set_axis_labels('State', 'Average Value')
+    g.tick_params(axis='x', rotation=60)
+    g.tight_layout()
+    g.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, file_name))
+    plt.close(g.figure)
+    return file_name
+
+def _plot_correlation(corr_matrix):
+    """
+    Heatmap of the nutrient correlation matrix.
+    """
+    file_name = 'nutrient_correlation_matrix.png'
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f", linewidths=.5)
+    plt.title('Correlation Matrix of Soil Nutrients')
+    plt.tight_layout()
+    plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, file_name))
+    plt.close()
+    return file_name
 
 # --- Main Analysis Logic ---
 def perform_eda_and_insights():
@@ -38,12 +147,24 @@ def perform_eda_and_insights():
     # Check if the consolidated data file exists
     if not os.path.exists(consolidated_file_path):
         logging.error(f"Consolidated data file not found at: {consolidated_file_path}. "
-                      "Please ensure 'consolidate_data.py' was run successfully.")
+                      "Please ensure 'get_raw_data.py' (or 'consolidate_data.py') was run successfully.")
         return # Exit if the file is not found
 
     try:
-        # Load the consolidated data into a Pandas DataFrame
-        df = pd.read_csv(consolidated_file_path)
+        # Load only the identifier and nutrient columns used below into a Pandas DataFrame.
+        # Parquet is columnar, so the remaining columns are never read from disk.
+        available_cols = pq.read_schema(consolidated_file_path).names
+        needed_cols = [col for col in ID_COLS + POTENTIAL_NUTRIENT_COLS if col in available_cols]
+        df = pd.read_parquet(consolidated_file_path, columns=needed_cols)
+        # The identifiers are a few distinct values repeated on every row; as categoricals they are stored
+        # once and grouped by integer codes. (They usually arrive dictionary-encoded from Parquet already.)
+        # Year stays a category rather than an integer since it holds labels such as '2023-24'.
+        id_cols = [col for col in ID_COLS if col in df.columns]
+        df[id_cols] = df[id_cols].astype('category')
+        # Dictionary-encoded columns keep their categories in file order, but groupby and the plots
+        # follow category order; sort them so years come out chronologically and states alphabetically
+        for col in id_cols:
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories), ordered=True)
         logging.info(f"Loaded consolidated data with {len(df)} rows and {len(df.columns)} columns.")
     except Exception as e:
         logging.critical(f"Error loading consolidated data from {consolidated_file_path}: {e}")
@@ -57,7 +178,8 @@ def perform_eda_and_insights():
     logging.info(f"First 5 rows:\n{df.head()}")
     logging.info(f"Column information:\n{df.info()}")
     logging.info(f"Descriptive statistics:\n{df.describe().T}") # Transpose for better readability
-    logging.info(f"Number of unique years: {df['year'].nunique()}")
+    num_years = df['year'].nunique() # Reused below to decide whether to plot trends
+    logging.info(f"Number of unique years: {num_years}")
     logging.info(f"Unique years: {df['year'].unique()}")
     logging.info(f"Number of unique states: {df['state'].nunique()}")
     logging.info(f"Unique states: {df['state'].unique()}")
@@ -65,18 +187,9 @@ def perform_eda_and_insights():
     logging.info(f"Number of unique blocks: {df['block'].nunique()}")
 
     # --- 2. Identify Key Nutrient Columns ---
-    # These columns are assumed to be numerical and represent nutrient values.
-    # Exclude identifier columns that should not be part of numerical analysis.
-    # Adjust this list based on the actual standardized column names from consolidate_data.py
-    # Common macro-nutrients: Nitrogen, Phosphorus, Potassium, Organic Carbon (pH is a property)
-    # Common micro-nutrients: Zinc, Iron, Manganese, Copper, Boron
-    # This list is based on common soil health parameters; verify against your actual data.
-    potential_nutrient_cols = [
-        'ph', 'ec', 'oc_percent', 'nitrogen', 'phosphorus', 'potassium',
-        'sulphur', 'zinc', 'iron', 'manganese', 'copper', 'boron'
-    ]
-    # Filter to only include columns actually present in the DataFrame and are numeric
-    nutrient_cols = [col for col in potential_nutrient_cols if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
+    # Filter POTENTIAL_NUTRIENT_COLS to only include columns actually present in the DataFrame and are numeric.
+    # Identifier columns are excluded since they should not be part of numerical analysis.
+    nutrient_cols = [col for col in POTENTIAL_NUTRIENT_COLS if col in df.columns and pd.api.types.is_numeric_dtype(df[col])]
     logging.info(f"\nIdentified numerical nutrient columns for analysis: {nutrient_cols}")
 
     if not nutrient_cols:
@@ -84,90 +197,64 @@ def perform_eda_and_insights():
                         "Please check the column naming and data types after consolidation.")
         return # Exit if no relevant columns are found for plotting
 
+    # float32 holds the lab values with ample precision at half the memory of float64
+    df[nutrient_cols] = df[nutrient_cols].astype('float32')
+
+    # Average of every nutrient per state and per year, computed in one pass each and
+    # reused by the trend plots, the state bar plots and the summary below
+    # observed=True leaves out categories with no rows
+    state_means = df.groupby('state', observed=True)[nutrient_cols].mean()
+    year_means = df.groupby('year', observed=True)[nutrient_cols].mean()
+
     # --- 3. Exploratory Data Analysis (EDA) and Visualizations ---
+    # Each figure is submitted to a pool of worker processes, which draw and save them in parallel
+    # while the remaining plots are prepared; the generated files are logged once all are done.
+    plots = []
+    with ProcessPoolExecutor(max_workers=PLOT_WORKERS, initializer=_init_plot_worker) as executor:
+        # Trend of key nutrients over years (if multiple years exist)
+        if num_years > 1:
+            logging.info("\n--- Nutrient Trends Over Years ---")
+            for nutrient in ['ph', 'oc_percent', 'nitrogen', 'phosphorus', 'potassium']:
+                if nutrient in nutrient_cols:
+                    plots.append(executor.submit(_plot_trend, year_means[nutrient].reset_index(), nutrient))
+                else:
+                    logging.warning(f"  Nutrient '{nutrient}' not found in data for trend analysis. Skipping plot.")
 
-    # Set a consistent style for plots
-    sns.set_style("whitegrid")
-    plt.rcParams['figure.dpi'] = 100 # Set higher DPI for better quality images
-    plt.rcParams['figure.figsize'] = (10, 6) # Default figure size
+        # Distribution of key nutrients
+        logging.info("\n--- Distribution of Key Nutrients ---")
+        plots.append(executor.submit(_plot_distributions, df[nutrient_cols]))
 
-    # Trend of key nutrients over years (if multiple years exist)
-    if df['year'].nunique() > 1:
-        logging.info("\n--- Nutrient Trends Over Years ---")
-        for nutrient in ['ph', 'oc_percent', 'nitrogen', 'phosphorus', 'potassium']:
+        # Regional variation (e.g., average nutrients by State)
+        logging.info("\n--- Regional Variation of Nutrients (by State) ---")
+        # For pH, a box plot can show distribution across states
+        if 'ph' in nutrient_cols:
+            plots.append(executor.submit(_plot_ph_boxplot, df[['state', 'ph']]))
+
+        # For other nutrients, bar plots of averages are useful; one panel per nutrient in a single figure
+        bar_nutrients = []
+        for nutrient in ['nitrogen', 'phosphorus', 'potassium', 'zinc', 'iron', 'boron']: # Example nutrients for state comparison
             if nutrient in nutrient_cols:
-                plt.figure() # Create a new figure for each plot
-                sns.lineplot(data=df.groupby('year')[nutrient].mean().reset_index(), x='year', y=nutrient, marker='o')
-                plt.title(f'Average {nutrient.replace("_", " ").title()} Over Years')
-                plt.xlabel('Year')
-                plt.ylabel(f'Average {nutrient.replace("_", " ").title()} Value')
-                plt.grid(True, linestyle='--', alpha=0.7)
-                plt.tight_layout()
-                plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, f'{nutrient}_trend_over_years.png'))
-                plt.close() # Close the plot to free memory
-                logging.info(f"  Generated {nutrient}_trend_over_years.png")
+                bar_nutrients.append(nutrient)
             else:
-                logging.warning(f"  Nutrient '{nutrient}' not found in data for trend analysis. Skipping plot.")
-
-    # Distribution of key nutrients
-    logging.info("\n--- Distribution of Key Nutrients ---")
-    for nutrient in nutrient_cols: # Iterate through all identified nutrient columns
-        plt.figure()
-        sns.histplot(df[nutrient], kde=True, bins=30)
-        plt.title(f'Distribution of {nutrient.replace("_", " ").title()}')
-        plt.xlabel(nutrient.replace("_", " ").title())
-        plt.ylabel('Frequency')
-        plt.tight_layout()
-        plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, f'{nutrient}_distribution.png'))
-        plt.close()
-        logging.info(f"  Generated {nutrient}_distribution.png")
-
-    # Regional variation (e.g., average nutrients by State)
-    logging.info("\n--- Regional Variation of Nutrients (by State) ---")
-    # For pH, a box plot can show distribution across states
-    if 'ph' in nutrient_cols:
-        plt.figure(figsize=(14, 8)) # Wider plot for many states
-        sns.boxplot(data=df, x='state', y='ph', palette='viridis')
-        plt.title('pH Distribution Across States')
-        plt.xlabel('State')
-        plt.ylabel('pH Value')
-        plt.xticks(rotation=60, ha='right') # Rotate labels for readability
-        plt.tight_layout()
-        plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, 'ph_by_state_boxplot.png'))
-        plt.close()
-        logging.info("  Generated ph_by_state_boxplot.png")
-
-    # For other nutrients, bar plots of averages are useful
-    for nutrient in ['nitrogen', 'phosphorus', 'potassium', 'zinc', 'iron', 'boron']: # Example nutrients for state comparison
-        if nutrient in nutrient_cols:
-            state_avg = df.groupby('state')[nutrient].mean().sort_values(ascending=False).reset_index()
-            plt.figure(figsize=(14, 8))
-            sns.barplot(data=state_avg, x='state', y=nutrient, palette='coolwarm')
-            plt.title(f'Average {nutrient.replace("_", " ").title()} Across States')
-            plt.xlabel('State')
-            plt.ylabel(f'Average {nutrient.replace("_", " ").title()} Value')
-            plt.xticks(rotation=60, ha='right')
-            plt.tight_layout()
-            plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, f'{nutrient}_by_state_barplot.png'))
-            plt.close()
-            logging.info(f"  Generated {nutrient}_by_state_barplot.png")
-        else:
-            logging.warning(f"  Nutrient '{nutrient}' not found for state-wise bar plot. Skipping.")
+                logging.warning(f"  Nutrient '{nutrient}' not found for state-wise bar plot. Skipping.")
+        if bar_nutrients:
+            # Plot the precomputed averages so catplot doesn't bootstrap a confidence interval per bar
+            state_avg = (state_means[bar_nutrients].reset_index()
+                         .melt(id_vars='state', var_name='nutrient', value_name='value'))
+            plots.append(executor.submit(_plot_state_bars, state_avg))
 
+        # Correlation Matrix of Nutrients
+        logging.info("\n--- Correlation Matrix of Nutrient Values ---")
+        if len(nutrient_cols) > 1: # Need at least two columns for correlation
+            plots.append(executor.submit(_plot_correlation, df[nutrient_cols].corr()))
+        else:
+            logging.warning("Not enough numerical nutrient columns to generate a correlation matrix.")
 
-    # Correlation Matrix of Nutrients
-    logging.info("\n--- Correlation Matrix of Nutrient Values ---")
-    if len(nutrient_cols) > 1: # Need at least two columns for correlation
-        corr_matrix = df[nutrient_cols].corr()
-        plt.figure(figsize=(12, 10))
-        sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f", linewidths=.5)
-        plt.title('Correlation Matrix of Soil Nutrients')
-        plt.tight_layout()
-        plt.savefig(os.path.join(ANALYSIS_OUTPUT_DIR, 'nutrient_correlation_matrix.png'))
-        plt.close()
-        logging.info("  Generated nutrient_correlation_matrix.png")
-    else:
-        logging.warning("Not enough numerical nutrient columns to generate a correlation matrix.")
+        for plot in plots:
+            try:
+                logging.info(f"  Generated {plot.result()}")
+            except Exception as e:
+                logging.error(f"  Failed to generate a plot: {e}")
 
 
     # --- 4. Identify Soil Health Patterns and Regional Trends ---
@@ -175,13 +262,13 @@ def perform_eda_and_insights():
 
     # Example: States with highest/lowest pH
     if 'ph' in nutrient_cols:
-        avg_ph_by_state = df.groupby('state')['ph'].mean().sort_values()
+        avg_ph_by_state = state_means['ph'].sort_values()
         logging.info(f"  States with highest average pH (most alkaline):\n{avg_ph_by_state.tail(5)}")
         logging.info(f"  States with lowest average pH (most acidic):\n{avg_ph_by_state.head(5)}")
 
     # Example: States with highest/lowest Organic Carbon
     if 'oc_percent' in nutrient_cols:
-        avg_oc_by_state = df.groupby('state')['oc_percent'].mean().sort_values()
+        avg_oc_by_state = state_means['oc_percent'].sort_values()
         logging.info(f"  States with highest average Organic Carbon:\n{avg_oc_by_state.tail(5)}")
         logging.info(f"  States with lowest average Organic Carbon:\n{avg_oc_by_state.head(5)}")
 
@@ -204,4 +291,5 @@ def perform_eda_and_insights():
                  f"Check '{ANALYSIS_OUTPUT_DIR}' folder for generated visualizations.")
 
 if __name__ == "__main__":
+    setup_logging()
     perform_eda_and_insights()